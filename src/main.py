@@ -29,6 +29,7 @@ from telegram.ext.filters import MessageFilter
 
 # Adjust import paths based on new structure
 from transcription_handler import (
+    init as init_transcription_handler,
     process_url_message,
     set_user_model,
     get_whisper_model,
@@ -40,6 +41,7 @@ from transcription_handler import (
     format_duration,
     get_whisper_language,
     set_user_language,
+    URL_RE,
 )
 from utils.bot_token import get_bot_token
 from utils.utils import print_startup_message, safe_split_message
@@ -120,6 +122,14 @@ class TranscriberBot:
         self.user_last_request = defaultdict(lambda: datetime.min)
         self.user_request_counts = defaultdict(int)
 
+        # get Telegram connection pool settings (one shared pool for all bot requests)
+        self.connection_pool_size = self.config.getint(
+            "GeneralSettings", "connectionpoolsize", fallback=256
+        )
+        self.pool_timeout = self.config.getfloat(
+            "GeneralSettings", "pooltimeout", fallback=10.0
+        )
+
         # Load the allowed formats from the configuration
         self.allowed_formats = self.config.get(
             "AllowedFileFormats", "allowed_formats", fallback="mp3, wav, mp4"
@@ -241,7 +251,7 @@ class TranscriberBot:
         )
 
         if update.message and update.message.text:
-            urls = re.findall(r"(https?://\S+)", update.message.text)
+            urls = URL_RE.findall(update.message.text)
 
             if urls:
                 await self.task_queue.put((update.message.text, context.bot, update))
@@ -997,7 +1007,13 @@ class TranscriberBot:
         connected = False
         while not connected:
             try:
-                self.application = Application.builder().token(self.token).build()
+                self.application = (
+                    Application.builder()
+                    .token(self.token)
+                    .connection_pool_size(self.connection_pool_size)
+                    .pool_timeout(self.pool_timeout)
+                    .build()
+                )
 
                 # Add command handlers first
                 self.application.add_handler(
@@ -1078,5 +1094,7 @@ if __name__ == "__main__":
         except Exception as e:
             logger.error(f"An error occurred while updating yt-dlp: {e}")
 
+    init_transcription_handler()  # logging, asyncio debug and output directories
+
     bot = TranscriberBot()
     bot.run()
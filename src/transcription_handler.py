@@ -12,10 +12,12 @@ import time
 import logging
 import re
 import threading
+import functools
+import contextlib
 import asyncio
 from asyncio.exceptions import TimeoutError
-import json
 import os
+import pathlib
 import textwrap
 import configparser
 from urllib.parse import urlparse, parse_qs
@@ -23,6 +25,11 @@ from datetime import datetime, timedelta
 
 # import wave
 from pydub import AudioSegment
+from yt_dlp import YoutubeDL
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.utils import DownloadError
+import aiofiles
+import aiofiles.os as aos
 
 # tg modules // button selection
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
@@ -43,23 +50,35 @@ USE_SNIPPET_FOR_DESCRIPTION = config.getboolean(
 DESCRIPTION_MAX_LINES = config.getint(
     "VideoDescriptionSettings", "description_max_lines", fallback=30
 )
+# How long fetched video details are kept in memory (seconds; 0 disables caching)
+VIDEO_DETAILS_CACHE_TTL = config.getint(
+    "YTDLPSettings", "video_details_cache_ttl", fallback=3600
+)
+# User agent and network timeout (seconds) for yt-dlp metadata lookups
+YTDLP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+YTDLP_SOCKET_TIMEOUT = 30
+# Request pacing and yt-dlp's own retry counts, to stay clear of YouTube's rate limits
+YTDLP_SLEEP_REQUESTS = 1
+YTDLP_RETRIES = 5
+YTDLP_FRAGMENT_RETRIES = 5
+YTDLP_EXTRACTOR_RETRIES = 3
+# Maximum number of concurrent Whisper transcriptions (GPU/CPU bound)
+MAX_CONCURRENT_TRANSCRIPTIONS = config.getint(
+    "WhisperSettings", "maxconcurrenttranscriptions", fallback=1
+)
+# Maximum number of concurrent yt-dlp runs (network bound)
+MAX_CONCURRENT_YTDLP_RUNS = config.getint(
+    "YTDLPSettings", "max_concurrent_runs", fallback=4
+)
 
-# Output directory for transcriptions; create if doesn't exist
+# Output directory for transcriptions (created in init())
 output_dir = "transcriptions"
-os.makedirs(output_dir, exist_ok=True)
 
-# Define and create audio directory
+# Define audio directory (created in init())
 audio_dir = "audio"
-os.makedirs(audio_dir, exist_ok=True)
 
 # Configure logging
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-
-# asyncio debugging on
-asyncio.get_event_loop().set_debug(True)
 
 # set the config base dir just once at the top of your script
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -76,6 +95,44 @@ user_languages = {}
 # lock the user languages
 user_languages_lock = threading.Lock()
 
+# Whisper models loaded in this process: {device: (model name, model)}
+whisper_models = {}
+
+# lock the loaded Whisper models
+whisper_models_lock = threading.Lock()
+
+# reusable YoutubeDL instances for metadata lookups, one per worker thread
+ytdlp_local = threading.local()
+
+# limit concurrent Whisper and yt-dlp runs; extra requests wait their turn
+whisper_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_TRANSCRIPTIONS))
+ytdlp_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_YTDLP_RUNS))
+
+# Cache of processed video details: {video_id: (fetch_time, details)}
+video_details_cache = {}
+
+
+# set up logging (unless the application already has), turn on asyncio
+# debugging and create the output directories; called once at startup
+# instead of on import
+def init():
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )
+
+    # asyncio debugging on, for the event loop the bot will run on
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    loop.set_debug(True)
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(audio_dir, exist_ok=True)
+
 
 # Modify the set_user_language function to use the lock
 def set_user_language(user_id, language):
@@ -193,6 +250,9 @@ def get_transcription_settings():
             "send_as_messages": config.getboolean(
                 "TranscriptionSettings", "sendasmessages", fallback=False
             ),
+            "reuse_transcriptions": config.getboolean(
+                "TranscriptionSettings", "reuseexistingtranscriptions", fallback=True
+            ),
         }
         logger.info(f"Loaded transcription settings: {transcription_settings}")
         return transcription_settings
@@ -203,54 +263,245 @@ def get_transcription_settings():
             "keep_audio_files": False,
             "send_as_files": True,
             "send_as_messages": False,
+            "reuse_transcriptions": True,
         }
 
 
+# start of the notice line that transcribe_audio adds to the .txt header
+TRANSCRIPT_HEADER_NOTICE = "[ Transcript generated with: https://github.com/FlyingFathead/whisper-transcriber-telegram-bot/ |"
+
+
+# remove the header that transcribe_audio prepends to a .txt transcription,
+# leaving the same raw text a fresh transcription run returns
+def strip_transcript_header(text):
+    notice_index = text.find(TRANSCRIPT_HEADER_NOTICE)
+    if notice_index == -1:
+        return text
+    header_end = text.find("]\n\n", notice_index)
+    if header_end == -1:
+        return text
+    return text[header_end + 3 :]
+
+
 # split long messages
 def split_message(message, max_length=4096):
     return [message[i : i + max_length] for i in range(0, len(message), max_length)]
 
 
-# // audio download (new method)
-async def download_audio(url, audio_path):
-    config = ConfigLoader.get_config()
+# a single Telegram message that is edited in place to report progress,
+# instead of sending a new message for every step
+class StatusMessage:
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message = None
+        self.text = None
+
+    async def update(self, text):
+        if text == self.text:
+            return  # Telegram rejects edits that don't change the text
+        if self.message is not None:
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id, message_id=self.message.message_id, text=text
+                )
+                self.text = text
+                return
+            except Exception as e:
+                logger.warning(f"Failed to edit status message, sending a new one: {e}")
+        self.message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+        self.text = text
+
+
+# find the non-empty txt/srt/vtt files for `base_filename` with a single
+# directory scan instead of a pair of stat calls per format (blocking)
+def scan_transcription_files(output_dir, base_filename):
+    wanted = {f"{base_filename}.{fmt}": fmt for fmt in ["txt", "srt", "vtt"]}
+    found = {}
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.name in wanted and entry.stat().st_size > 0:
+                found[wanted[entry.name]] = f"{output_dir}/{entry.name}"
+    # keep the txt, srt, vtt order regardless of the directory order
+    return {fmt: found[fmt] for fmt in ["txt", "srt", "vtt"] if fmt in found}
+
+
+# find the transcription files without blocking the event loop
+async def find_transcription_files(output_dir, base_filename):
+    return await asyncio.to_thread(scan_transcription_files, output_dir, base_filename)
+
+
+# look up transcription files left by an earlier run of the same audio;
+# only a complete set of txt/srt/vtt files counts
+async def get_existing_transcriptions(output_dir, base_filename):
+    found = await find_transcription_files(output_dir, base_filename)
+    return found if len(found) == 3 else {}
+
+
+# send a single transcription file; errors are logged so that
+# concurrent sends of the other formats are not affected
+async def send_transcription_file(bot, chat_id, fmt, path):
+    try:
+        # pass the path and let the Telegram library open and read the file
+        await bot.send_document(
+            chat_id=chat_id,
+            document=pathlib.Path(path),
+            filename=os.path.basename(path),
+        )
+        logger.info(f"Sent {fmt} file to user {chat_id}: {path}")
+    except Exception as e:
+        logger.error(f"Failed to send {fmt} file to user {chat_id}: {path}, error: {e}")
+
+
+# check whether the URL's domain is configured for full video downloads
+def requires_video_download(url):
     ytdlp_settings = ConfigLoader.get_ytdlp_domain_settings()
+    parsed_url = urlparse(url)
+    domain = parsed_url.netloc.lower()
+    if domain.startswith("www."):
+        domain = domain[4:]  # Remove 'www.'
+    return ytdlp_settings["active"] and domain in ytdlp_settings["domains"]
+
+
+# fetch the video details and the audio track; for regular URLs both come
+# from a single yt-dlp run, only full-video domains need a separate download
+async def fetch_and_download(url, audio_path):
+    if requires_video_download(url):
+        details = await fetch_video_details(url)
+        await download_audio(url, audio_path)
+    else:
+        details = await fetch_video_details(url, audio_path=audio_path)
+    return details, audio_path
+
+
+# yt-dlp options shared by all YoutubeDL instances
+# (only called from worker threads, so the blocking file check is fine here)
+def get_ytdlp_options(**extra_options):
+    config = ConfigLoader.get_config()
     use_cookies = config.getboolean("YTDLPSettings", "use_cookies", fallback=False)
     cookies_file = config.get(
         "YTDLPSettings", "cookies_file", fallback="config/cookies.txt"
     )
+    options = {
+        "quiet": True,
+        "no_warnings": True,
+        "noprogress": True,
+        "logger": logger,
+        # skip the extra requests we have no use for
+        "getcomments": False,
+        "check_formats": False,
+        # pace requests and let yt-dlp retry transient errors on its own
+        "sleep_interval_requests": YTDLP_SLEEP_REQUESTS,
+        "retries": YTDLP_RETRIES,
+        "fragment_retries": YTDLP_FRAGMENT_RETRIES,
+        "extractor_retries": YTDLP_EXTRACTOR_RETRIES,
+    }
+    if use_cookies and os.path.exists(cookies_file):
+        options["cookiefile"] = cookies_file
+    options.update(extra_options)
+    return options
+
+
+# look up video info without downloading (blocking; run in a thread)
+def extract_video_info(url):
+    ydl = getattr(ytdlp_local, "metadata_ydl", None)
+    if ydl is None:
+        options = get_ytdlp_options(
+            http_headers={"User-Agent": YTDLP_USER_AGENT},
+            socket_timeout=YTDLP_SOCKET_TIMEOUT,
+            # don't resolve every entry of a playlist just to show its details
+            extract_flat="in_playlist",
+        )
+        if "cookiefile" in options:
+            # closing the instance is what writes refreshed cookies back to
+            # the cookie file, so with cookies each lookup gets its own
+            with YoutubeDL(options) as ydl:
+                return ydl.extract_info(url, download=False)
+        # without cookies the instance is reused for all lookups from this thread
+        ydl = YoutubeDL(options)
+        ytdlp_local.metadata_ydl = ydl
+    return ydl.extract_info(url, download=False)
+
+
+# download media and return its video info (blocking; run in a thread)
+def download_with_ytdlp(url, **options):
+    # the output template differs per download, so each one gets its own instance
+    with YoutubeDL(get_ytdlp_options(**options)) as ydl:
+        return ydl.extract_info(url, download=True)
+
+
+# check whether a yt-dlp failure is worth retrying: rate limiting (HTTP 429),
+# server errors and network errors are; unavailable videos, sign-in walls or
+# a missing ffmpeg are not
+def is_transient_ytdlp_error(error):
+    pending, seen = [error], set()
+    while pending:
+        exc = pending.pop()
+        if not isinstance(exc, BaseException) or id(exc) in seen:
+            continue
+        seen.add(id(exc))
+        if isinstance(exc, HTTPError):
+            return exc.status == 429 or exc.status >= 500
+        if isinstance(exc, TransportError):
+            return True
+        # yt-dlp keeps the original exception in `exc_info` or `cause`
+        exc_info = getattr(exc, "exc_info", None)
+        if exc_info:
+            pending.append(exc_info[1])
+        pending.extend([getattr(exc, "cause", None), exc.__cause__, exc.__context__])
+    return "HTTP Error 429" in str(error)
+
+
+# run a blocking yt-dlp call in a thread, retrying transient failures (e.g.
+# YouTube answering 429) with exponential backoff; the semaphore is released
+# while waiting so the backoff doesn't hold up other requests
+async def run_ytdlp_with_retry(func, *args, max_retries=3, base_delay=5, **kwargs):
+    for attempt in range(max_retries):
+        try:
+            async with ytdlp_semaphore:
+                return await asyncio.to_thread(func, *args, **kwargs)
+        except DownloadError as e:
+            logger.warning(f"Attempt {attempt + 1} failed: {e}")
+            if not is_transient_ytdlp_error(e):
+                raise
+            if attempt >= max_retries - 1:
+                logger.error("All retry attempts failed.")
+                raise
+            wait_time = base_delay * (2**attempt)
+            logger.info(f"Retrying after {wait_time} seconds...")
+            await asyncio.sleep(wait_time)
+
+
+# yt-dlp options for downloading the audio track as mp3 to `audio_path`
+def get_audio_download_options(audio_path):
+    return {
+        "format": "bestaudio/best",
+        "outtmpl": f"{os.path.splitext(audio_path)[0]}.%(ext)s",
+        "postprocessors": [
+            {"key": "FFmpegExtractAudio", "preferredcodec": "mp3"},
+        ],
+    }
+
+
+# // audio download (new method)
+async def download_audio(url, audio_path):
+    config = ConfigLoader.get_config()
     use_worst_video_quality = config.getboolean(
         "YTDLPSettings", "use_worst_video_quality", fallback=True
     )
 
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc.lower()
-    if domain.startswith("www."):
-        domain = domain[4:]  # Remove 'www.'
-
-    should_download_video = (
-        ytdlp_settings["active"] and domain in ytdlp_settings["domains"]
-    )
+    should_download_video = requires_video_download(url)
 
     if should_download_video:
         logger.info("Identified domain requiring full video download.")
-        # Step 1: Get available formats in JSON
-        command = ["yt-dlp", "--no-warnings", "--dump-json", url]
-        if use_cookies and os.path.exists(cookies_file):
-            command.extend(["--cookies", cookies_file])
-
-        process = await asyncio.create_subprocess_exec(
-            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout_data, stderr_data = await process.communicate()
-        if process.returncode != 0:
-            stderr_output = stderr_data.decode()
-            logger.error(f"Failed to get video formats: {stderr_output}")
-            raise Exception(f"Failed to get video formats: {stderr_output}")
+        # Step 1: Get available formats
+        try:
+            video_info = await run_ytdlp_with_retry(extract_video_info, url)
+        except DownloadError as e:
+            logger.error(f"Failed to get video formats: {e}")
+            raise Exception(f"Failed to get video formats: {e}")
 
-        # Step 2: Parse JSON to find the appropriate format
-        video_info = json.loads(stdout_data.decode())
+        # Step 2: Find the appropriate format
         formats = video_info.get("formats", [])
 
         if not formats:
@@ -306,64 +557,22 @@ async def download_audio(url, audio_path):
             f"{base_output_path}.%(ext)s"  # e.g., audio/12345_1618033988.mp4
         )
 
-        command = [
-            "yt-dlp",
-            # "--verbose", # uncomment to set verbose
-            "--format",
-            selected_format_id,
-            "--output",
-            video_output_template,
-            url,
-        ]
-        if use_cookies and os.path.exists(cookies_file):
-            command.extend(["--cookies", cookies_file])
+        download_options = {
+            "format": selected_format_id,
+            "outtmpl": video_output_template,
+        }
 
         logger.info("Downloading the selected quality video with audio...")
     else:
         # Download audio-only as mp3
-        command = [
-            "yt-dlp",
-            "--extract-audio",
-            "--audio-format",
-            "mp3",
-            "--output",
-            audio_path,
-            url,
-        ]
-        if use_cookies and os.path.exists(cookies_file):
-            command.extend(["--cookies", cookies_file])
+        download_options = get_audio_download_options(audio_path)
         logger.info("Downloading audio-only...")
 
-    # Start the subprocess
-    process = await asyncio.create_subprocess_exec(
-        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-
-    # Read and log output
-    stdout_lines = []
-    stderr_lines = []
-
-    async def read_stream(stream, lines, log_func):
-        while True:
-            line = await stream.readline()
-            if line:
-                decoded_line = line.decode().rstrip()
-                lines.append(decoded_line)
-                log_func(decoded_line)
-            else:
-                break
-
-    await asyncio.gather(
-        read_stream(process.stdout, stdout_lines, logger.info),
-        read_stream(process.stderr, stderr_lines, logger.error),
-    )
-
-    await process.wait()
-
-    if process.returncode != 0:
-        stderr_output = "\n".join(stderr_lines)
-        logger.error(f"yt-dlp failed with error:\n{stderr_output}")
-        raise Exception(f"Failed to download media: {stderr_output}")
+    try:
+        await run_ytdlp_with_retry(download_with_ytdlp, url, **download_options)
+    except DownloadError as e:
+        logger.error(f"yt-dlp failed with error:\n{e}")
+        raise Exception(f"Failed to download media: {e}")
 
     if should_download_video:
         # Step 4: Extract audio from the downloaded video
@@ -381,7 +590,7 @@ async def download_audio(url, audio_path):
         video_file = None
         for ext in video_extensions:
             potential_video = f"{base_output_path}.{ext}"
-            if os.path.exists(potential_video):
+            if await aos.path.exists(potential_video):
                 video_file = potential_video
                 break
 
@@ -404,51 +613,140 @@ async def download_audio(url, audio_path):
 
         try:
             logger.info(f"Removing temporary video file: {video_file}")
-            os.remove(video_file)
+            await aos.remove(video_file)
             logger.info(f"Temporary video file {video_file} removed.")
         except Exception as e:
             logger.warning(f"Failed to remove temporary video file {video_file}: {e}")
     else:
-        if not os.path.exists(audio_path):
+        if not await aos.path.exists(audio_path):
             raise Exception(f"Failed to download audio: {audio_path}")
         logger.info(f"Audio downloaded successfully: {audio_path}")
 
 
-# Read from stream line by line until EOF, call callback on each line.
-async def read_stream(stream, callback):
-    while True:
-        line = await stream.readline()
-        if line:
-            callback(line.decode())
-        else:
-            break
+# pick the CTranslate2 device, device index and quantization for a torch-style device
+def get_faster_whisper_device(device):
+    if device.startswith("cuda"):
+        device_index = int(device.split(":")[1]) if ":" in device else 0
+        return "cuda", device_index, "int8_float16"
+    return "cpu", 0, "int8"
 
 
-# Log each line from the stdout.
-def log_stdout(line):
-    logger.info(f"Whisper stdout: {line.strip()}")
+# load a Whisper model once per device and keep it in memory for later requests
+# (a different model for the same device replaces the previous one to free VRAM)
+def get_loaded_whisper_model(model, device):
+    with whisper_models_lock:
+        loaded = whisper_models.get(device)
+        if loaded is None or loaded[0] != model:
+            # imported here; the library is only needed for local transcription
+            from faster_whisper import WhisperModel
 
+            ct2_device, device_index, compute_type = get_faster_whisper_device(device)
+            logger.info(
+                f"Loading Whisper model '{model}' on device: {device} ({compute_type})"
+            )
+            whisper_models[device] = (
+                model,
+                WhisperModel(
+                    model,
+                    device=ct2_device,
+                    device_index=device_index,
+                    compute_type=compute_type,
+                ),
+            )
+        return whisper_models[device][1]
 
-# Log each line from the stderr.
-def log_stderr(line):
-    logger.error(f"Whisper stderr: {line.strip()}")
 
+# format seconds as a subtitle timestamp, i.e. 00:01:02,345
+def format_timestamp(seconds, decimal_marker=","):
+    milliseconds = round(seconds * 1000.0)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1_000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
 
-async def transcribe_with_replicate(audio_path):
 
-    audio = open(audio_path, "rb")
-    input = {"audio": audio, "language": "es"}
+# run the transcription and write the txt/srt/vtt files (blocking; run in a thread)
+def run_whisper_transcription(
+    audio, output_dir, base_filename, model, device, language
+):
+    whisper_model = get_loaded_whisper_model(model, device)
+    transcribe_options = {"beam_size": 5}
+    if language and language != "auto":
+        transcribe_options["language"] = language
+    segments, info = whisper_model.transcribe(audio, **transcribe_options)
+    logger.info(
+        f"Transcribing {info.duration:.1f}s of audio, language: {info.language}"
+    )
 
-    output = await replicate.async_run(
-        "openai/whisper:cdd97b257f93cb89dede1c7584e3f3dfc969571b357dbcee08e793740bedd854",
-        input=input,
+    # segments are decoded lazily, so they are written out as they arrive
+    write_transcription_files(
+        ((segment.start, segment.end, segment.text) for segment in segments),
+        output_dir,
+        base_filename,
     )
+
+
+# write (start, end, text) segments to the txt/srt/vtt files in one pass and
+# return their paths (blocking; run in a thread); the files go to temporary
+# names first, so a failed run never leaves partial files that would later
+# be picked up as a finished transcription
+def write_transcription_files(segments, output_dir, base_filename):
+    base_path = os.path.join(output_dir, base_filename)
+    run_suffix = f"{os.getpid()}-{threading.get_ident()}.part"
+    final_paths = {fmt: f"{base_path}.{fmt}" for fmt in ["txt", "srt", "vtt"]}
+    part_paths = {fmt: f"{path}.{run_suffix}" for fmt, path in final_paths.items()}
+    try:
+        with contextlib.ExitStack() as stack:
+            txt_file, srt_file, vtt_file = (
+                stack.enter_context(open(part_path, "w"))
+                for part_path in part_paths.values()
+            )
+            vtt_file.write("WEBVTT\n\n")
+            for index, (start, end, text) in enumerate(segments, start=1):
+                text = text.strip()
+                txt_file.write(f"{text}\n")
+                srt_file.write(
+                    f"{index}\n{format_timestamp(start)} --> "
+                    f"{format_timestamp(end)}\n{text}\n\n"
+                )
+                vtt_file.write(
+                    f"{format_timestamp(start, '.')} --> "
+                    f"{format_timestamp(end, '.')}\n{text}\n\n"
+                )
+        for fmt, part_path in part_paths.items():
+            os.replace(part_path, final_paths[fmt])
+    finally:
+        for part_path in part_paths.values():
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return final_paths
+
+
+# transcribe with Replicate; with `output_dir` and `base_filename` given, the
+# result is also saved as txt/srt/vtt files, so that later requests for the
+# same video can reuse them
+async def transcribe_with_replicate(audio_path, output_dir=None, base_filename=None):
+    with open(audio_path, "rb") as audio:
+        input = {"audio": audio, "language": "es"}
+
+        output = await replicate.async_run(
+            "openai/whisper:cdd97b257f93cb89dede1c7584e3f3dfc969571b357dbcee08e793740bedd854",
+            input=input,
+        )
     print(output)
-    transcription = "\n".join(
-        segment.get("text") for segment in output.get("segments", [])
+    segments = [
+        (segment.get("start", 0), segment.get("end", 0), segment.get("text", ""))
+        for segment in output.get("segments", [])
+    ]
+    # the same text as the .txt file, which is what a reused transcription sends
+    transcription = "".join(f"{text.strip()}\n" for _, _, text in segments)
+    if not segments or output_dir is None or base_filename is None:
+        return {}, transcription
+
+    transcription_paths = await asyncio.to_thread(
+        write_transcription_files, segments, output_dir, base_filename
     )
-    print(transcription)
-    return [], transcription
+    return transcription_paths, transcription
 
 
 # transcription logic with header inclusion based on settings
@@ -465,61 +763,43 @@ async def transcribe_audio(
     model,
     device,
     language,
+    base_filename=None,
 ):
     print("hola")
     log_gpu_utilization()  # Log GPU utilization before starting transcription
 
+    # `base_filename` names the transcription files (e.g. after the video ID);
+    # by default they are named after the audio file
+    if base_filename is None:
+        base_filename = os.path.splitext(os.path.basename(audio_path))[0]
+
     logger.info(f"Using device: {device} for transcription")
-    transcription_command = [
-        "whisper",
-        audio_path,
-        "--model",
-        model,
-        "--output_dir",
-        output_dir,
-        "--device",
-        device,
-    ]
     if language and language != "auto":
         logger.info(
-            f"Starting transcription with model '{model}' and language '{language}' for: {audio_path}"
+            f"Starting transcription with model '{model}' and language '{language}' for: {base_filename}"
         )
-        transcription_command.extend(["--language", language])
     else:
         logger.info(
-            f"Starting transcription with model '{model}' and autodetect language for: {audio_path}"
+            f"Starting transcription with model '{model}' and autodetect language for: {base_filename}"
         )
 
-    # Log the transcription command
-    logger.info(f"Transcription command: {' '.join(transcription_command)}")
-
     try:
-        # Start the subprocess and get stdout, stderr streams
-        process = await asyncio.create_subprocess_exec(
-            *transcription_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-
-        # Concurrently log stdout and stderr
-        await asyncio.gather(
-            read_stream(process.stdout, log_stdout),
-            read_stream(process.stderr, log_stderr),
-        )
-
-        # Wait for the subprocess to finish
-        await process.wait()
-
-        if process.returncode != 0:
-            logger.error(
-                f"Whisper process failed with return code {process.returncode}"
+        # the semaphore also keeps two requests off the same loaded model
+        async with whisper_semaphore:
+            await asyncio.to_thread(
+                run_whisper_transcription,
+                audio_path,
+                output_dir,
+                base_filename,
+                model,
+                device,
+                language,
             )
-            return {}, ""
 
-        logger.info(f"Whisper transcription completed for: {audio_path}")
+        logger.info(f"Whisper transcription completed for: {base_filename}")
 
         # Generate the header if needed, now including the model used
-        ai_transcript_header = f"[ Transcript generated with: https://github.com/FlyingFathead/whisper-transcriber-telegram-bot/ | OpenAI Whisper model: `{model}` | Language: `{language}` ]"
+        ai_transcript_header = f"{TRANSCRIPT_HEADER_NOTICE} OpenAI Whisper model: `{model}` | Language: `{language}` ]"
         header_content = ""
 
         if include_header:
@@ -527,30 +807,28 @@ async def transcribe_audio(
             header_content = f"{video_info_message}\n\n{ai_transcript_header}\n\n"
 
         # Verify and log the generated files, adding header to .txt file if necessary
-        base_filename = os.path.splitext(os.path.basename(audio_path))[0]
         created_files = {}
         raw_content = ""
 
-        for fmt in ["txt", "srt", "vtt"]:
-            file_path = f"{output_dir}/{base_filename}.{fmt}"
-            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-                if fmt == "txt":
-                    with open(file_path, "r") as f:
-                        raw_content = f.read()
-                    if include_header:
-                        # Prepend the header for txt file
-                        try:
-                            with open(file_path, "r") as original:
-                                data = original.read()
-                            with open(file_path, "w") as modified:
-                                modified.write(header_content + data)
-                        except Exception as e:
-                            logger.error(f"Error adding header to {file_path}: {e}")
-
-                created_files[fmt] = file_path
-                logger.info(
-                    f"Transcription file {'updated' if fmt == 'txt' and include_header else 'created'}: {file_path}"
-                )
+        found_files = await find_transcription_files(output_dir, base_filename)
+        for fmt, file_path in found_files.items():
+            if fmt == "txt":
+                with open(file_path, "r") as f:
+                    raw_content = f.read()
+                if include_header:
+                    # Prepend the header for txt file
+                    try:
+                        with open(file_path, "r") as original:
+                            data = original.read()
+                        with open(file_path, "w") as modified:
+                            modified.write(header_content + data)
+                    except Exception as e:
+                        logger.error(f"Error adding header to {file_path}: {e}")
+
+            created_files[fmt] = file_path
+            logger.info(
+                f"Transcription file {'updated' if fmt == 'txt' and include_header else 'created'}: {file_path}"
+            )
 
         # Return created files and raw content for further processing
         return created_files, raw_content
@@ -572,7 +850,15 @@ async def process_url_message(message_text, bot, update, model, language):
         )
 
         user_id = update.effective_user.id
-        urls = re.findall(r"(https?://\S+)", message_text)
+        # drop repeated URLs, including different URL forms of the same video;
+        # the same video would otherwise be fetched and transcribed twice
+        urls = []
+        seen_keys = set()
+        for url in URL_RE.findall(message_text):
+            key = get_video_key(url)
+            if key not in seen_keys:
+                seen_keys.add(key)
+                urls.append(url)
 
         # Get the allowallsites setting from the configuration
         config = ConfigLoader.get_config()
@@ -580,42 +866,80 @@ async def process_url_message(message_text, bot, update, model, language):
             "GeneralSettings", "allowallsites", fallback=False
         )
 
-        for url in urls:
+        # Handle a single URL; status messages for one video stay in order,
+        # while separate videos progress independently of each other.
+        async def _handle_one(url, index):
+            status = StatusMessage(bot, update.effective_chat.id)
+            try:
+                if not allow_all_sites and not ("youtube" in url or "youtu.be" in url):
+                    await status.update(
+                        "❌ Unsupported URL format. Currently, only YouTube URLs are fully supported."
+                    )
+                    return
+
+                # Normalize YouTube URL if it's a YouTube URL
+                if "youtube" in url or "youtu.be" in url:
+                    normalized_url = normalize_youtube_url(url)
+                    if not normalized_url:
+                        await status.update("Invalid YouTube URL.")
+                        return
+                else:
+                    # For non-YouTube URLs, use the URL directly
+                    normalized_url = url
 
-            if not allow_all_sites and not ("youtube" in url or "youtu.be" in url):
-                await bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="❌ Unsupported URL format. Currently, only YouTube URLs are fully supported.",
+                logger.info(
+                    f"User {user_id} requested a transcript for normalized URL: {normalized_url}"
                 )
-                continue
+                await status.update("🔄 Processing URL...")
 
-            # Normalize YouTube URL if it's a YouTube URL
-            if "youtube" in url or "youtu.be" in url:
-                normalized_url = normalize_youtube_url(url)
-                if not normalized_url:
-                    await bot.send_message(
-                        chat_id=update.effective_chat.id, text="Invalid YouTube URL."
+                # YouTube transcriptions are named after the video ID, so that
+                # they can be reused on later requests; the audio file stays
+                # per task, since other requests may be downloading the same video
+                video_id = None
+                if "youtube" in normalized_url or "youtu.be" in normalized_url:
+                    try:
+                        video_id = extract_youtube_video_id(normalized_url)
+                    except ValueError:
+                        video_id = None
+
+                audio_file_name = f"{user_id}_{int(time.time())}_{index}.mp3"
+                audio_path = os.path.join(audio_dir, audio_file_name)
+                video_info_message = "Transcription initiated."
+
+                existing_paths = {}
+                if video_id and transcription_settings["reuse_transcriptions"]:
+                    existing_paths = await get_existing_transcriptions(
+                        output_dir, video_id
                     )
-                    continue
-            else:
-                # For non-YouTube URLs, use the URL directly
-                normalized_url = url
 
-            logger.info(
-                f"User {user_id} requested a transcript for normalized URL: {normalized_url}"
-            )
-            await bot.send_message(
-                chat_id=update.effective_chat.id, text="🔄 Processing URL..."
-            )
+                await status.update(
+                    "📥 Fetching video details..."
+                    if existing_paths
+                    else "📥 Fetching video details and the audio track..."
+                )
 
-            audio_file_name = f"{user_id}_{int(time.time())}.mp3"
-            audio_path = os.path.join(audio_dir, audio_file_name)
-            video_info_message = "Transcription initiated."
+                # Wrap fetch_and_download in try-except
+                try:
+                    if existing_paths:
+                        logger.info("Fetching video details...")
+                        details = await fetch_video_details(normalized_url)
+                    else:
+                        logger.info("Fetching video details and audio...")
+                        details, audio_path = await fetch_and_download(
+                            normalized_url, audio_path
+                        )
+                except Exception as e:
+                    error_message = str(e)
+                    # Truncate error_message if it's too long
+                    max_message_length = 4000  # Adjust as needed
+                    if len(error_message) > max_message_length:
+                        error_message = error_message[:max_message_length] + "..."
+                    logger.error(
+                        f"Fetching details or audio failed for URL: {normalized_url}, error: {error_message}"
+                    )
+                    await status.update(f"❌ Error: {error_message}")
+                    return  # Skip to the next URL if any
 
-            # Wrap fetch_video_details in try-except
-            try:
-                logger.info("Fetching video details...")
-                details = await fetch_video_details(normalized_url)
                 details["video_url"] = normalized_url
                 video_info_message = create_video_info_message(details)
                 for part in split_message(video_info_message):
@@ -624,190 +948,173 @@ async def process_url_message(message_text, bot, update, model, language):
                         text=f"<code>{part}</code>",
                         parse_mode="HTML",
                     )
-            except Exception as e:
-                error_message = str(e)
-                logger.error(
-                    f"An error occurred while fetching video details: {error_message}"
-                )
-                await bot.send_message(
-                    chat_id=update.effective_chat.id, text=f"❌ Error: {error_message}"
-                )
-                continue  # Skip to the next URL if any
 
-            await bot.send_message(
-                chat_id=update.effective_chat.id, text="📥 Fetching the audio track..."
-            )
-
-            # Wrap download_audio in try-except
-            try:
-                await download_audio(normalized_url, audio_path)
-            except Exception as e:
-                # error_message = str(e)
-                # await bot.send_message(chat_id=update.effective_chat.id, text=f"Error: {error_message}")
-                # logger.error(f"Download audio failed for URL: {normalized_url}, error: {error_message}")
-
-                error_message = str(e)
-                # Truncate error_message if it's too long
-                max_message_length = 4000  # Adjust as needed
-                if len(error_message) > max_message_length:
-                    error_message = error_message[:max_message_length] + "..."
-                await bot.send_message(
-                    chat_id=update.effective_chat.id, text=f"Error: {error_message}"
-                )
-                logger.error(
-                    f"Download audio failed for URL: {normalized_url}, error: {error_message}"
-                )
-
-                continue
-
-            if not os.path.exists(audio_path):
-                logger.info(f"Audio download failed for URL: {normalized_url}")
-                await bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="❌ Failed to download audio. Please ensure the URL is correct and points to a supported video.",
-                )
-                continue
-
-            # Add this line to notify the user
-            await bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="✅ Audio download successful. Proceeding with transcription...",
-            )
+                if existing_paths:
+                    logger.info(
+                        f"Reusing existing transcription for video {video_id}: {existing_paths}"
+                    )
+                    await status.update(
+                        "♻️ This video has already been transcribed. Sending the existing transcription..."
+                    )
+                    transcription_paths = existing_paths
+                    async with aiofiles.open(existing_paths["txt"], "r") as f:
+                        raw_content = strip_transcript_header(await f.read())
+                else:
+                    if not await aos.path.exists(audio_path):
+                        logger.info(f"Audio download failed for URL: {normalized_url}")
+                        await status.update(
+                            "❌ Failed to download audio. Please ensure the URL is correct and points to a supported video."
+                        )
+                        return
 
-            # model = get_whisper_model(user_id)
-            audio_duration = details.get("audio_duration", 0)
-            estimated_time = estimate_transcription_time(model, audio_duration)
-            estimated_minutes = estimated_time / 60
-            current_time = datetime.now()
-            estimated_finish_time = current_time + timedelta(minutes=estimated_minutes)
+                    # Add this line to notify the user
+                    await status.update(
+                        "✅ Audio download successful. Proceeding with transcription..."
+                    )
 
-            time_now_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-            estimated_finish_time_str = estimated_finish_time.strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
+                    # model = get_whisper_model(user_id)
+                    audio_duration = details.get("audio_duration", 0)
+                    estimated_time = estimate_transcription_time(model, audio_duration)
+                    estimated_minutes = estimated_time / 60
+                    current_time = datetime.now()
+                    estimated_finish_time = current_time + timedelta(
+                        minutes=estimated_minutes
+                    )
 
-            log_message = (
-                f"User ID: {user_id}\n"
-                f"Requested URL for transcription: {normalized_url}\n"
-            )
+                    time_now_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
+                    estimated_finish_time_str = estimated_finish_time.strftime(
+                        "%Y-%m-%d %H:%M:%S"
+                    )
 
-            best_gpu = get_best_gpu()
-            if best_gpu:
-                device = f"cuda:{best_gpu.id}"
-                gpu_message = (
-                    f"Using GPU {best_gpu.id}: {best_gpu.name}\n"
-                    f"Free Memory: {best_gpu.memoryFree} MB\n"
-                    f"Load: {best_gpu.load * 100:.1f}%"
-                )
-            else:
-                device = "cpu"
-                gpu_message = "⚠️ WARNING: No CUDA GPU available, using CPU for transcription. This will be much slower than estimated."
-
-            logger.info(gpu_message)
-            await bot.send_message(chat_id=update.effective_chat.id, text=gpu_message)
-
-            language_setting = language if language else "autodetection"
-            detailed_message = (
-                # f"Whisper model in use:\n{model}\n\n"
-                f"Model language set to:\n{language_setting}\n\n"
-                f"Estimated transcription time:\n{estimated_minutes:.1f} minutes.\n\n"
-                f"Time now:\n{time_now_str}\n\n"
-                f"Time when finished (estimate):\n{estimated_finish_time_str}\n\n"
-                "🎙️✍️ Transcribing audio..."
-            )
+                    log_message = (
+                        f"User ID: {user_id}\n"
+                        f"Requested URL for transcription: {normalized_url}\n"
+                    )
 
-            logger.info(f"{log_message}")
-            logger.info(f"{detailed_message}")
+                    best_gpu = get_best_gpu()
+                    if best_gpu:
+                        device = f"cuda:{best_gpu.id}"
+                        gpu_message = (
+                            f"Using GPU {best_gpu.id}: {best_gpu.name}\n"
+                            f"Free Memory: {best_gpu.memoryFree} MB\n"
+                            f"Load: {best_gpu.load * 100:.1f}%"
+                        )
+                    else:
+                        device = "cpu"
+                        gpu_message = "⚠️ WARNING: No CUDA GPU available, using CPU for transcription. This will be much slower than estimated."
+
+                    logger.info(gpu_message)
+
+                    language_setting = language if language else "autodetection"
+                    detailed_message = (
+                        # f"Whisper model in use:\n{model}\n\n"
+                        f"Model language set to:\n{language_setting}\n\n"
+                        f"Estimated transcription time:\n{estimated_minutes:.1f} minutes.\n\n"
+                        f"Time now:\n{time_now_str}\n\n"
+                        f"Time when finished (estimate):\n{estimated_finish_time_str}\n\n"
+                        "🎙️✍️ Transcribing audio..."
+                    )
 
-            await bot.send_message(
-                chat_id=update.effective_chat.id, text=detailed_message
-            )
+                    logger.info(f"{log_message}")
+                    logger.info(f"{detailed_message}")
+
+                    await status.update(f"{gpu_message}\n\n{detailed_message}")
+
+                    # transcription_paths, raw_content = await transcribe_audio(
+                    #     bot,
+                    #     update,
+                    #     audio_path,
+                    #     output_dir,
+                    #     normalized_url,
+                    #     video_info_message,
+                    #     transcription_settings["include_header"],
+                    #     model,
+                    #     device,
+                    #     language,
+                    #     base_filename=video_id,
+                    # )
+                    transcription_paths, raw_content = await transcribe_with_replicate(
+                        audio_path,
+                        output_dir,
+                        video_id or os.path.splitext(audio_file_name)[0],
+                    )
 
-            # transcription_paths, raw_content = await transcribe_audio(
-            #     bot,
-            #     update,
-            #     audio_path,
-            #     output_dir,
-            #     normalized_url,
-            #     video_info_message,
-            #     transcription_settings["include_header"],
-            #     model,
-            #     device,
-            #     language,
-            # )
-            transcription_paths, raw_content = await transcribe_with_replicate(
-                audio_path,
-            )
+                    if not transcription_paths:
+                        await status.update("Failed to transcribe audio.")
+                        if await aos.path.exists(audio_path):
+                            await aos.remove(audio_path)
+                        return
 
-            if not transcription_paths:
-                await bot.send_message(
-                    chat_id=update.effective_chat.id, text="Failed to transcribe audio."
+                # Add debugging here to see the settings at this point
+                logger.info(
+                    f"send_as_messages setting before condition check: {transcription_settings['send_as_messages']}"
                 )
-                if os.path.exists(audio_path):
-                    os.remove(audio_path)
-                continue
 
-            # Add debugging here to see the settings at this point
-            logger.info(
-                f"send_as_messages setting before condition check: {transcription_settings['send_as_messages']}"
-            )
-
-            # Here is where we add the transcription_note
-            transcription_note = "📝🔊 <i>(transcribed audio)</i>\n\n"
-            note_length = len(transcription_note)
-            max_message_length = (
-                4096 - note_length
-            )  # Adjust max length to account for transcription note
-
-            if (
-                transcription_settings["send_as_messages"]
-                and "txt" in transcription_paths
-            ):
-                try:
-                    logger.info(
-                        f"Preparing to send plain text message from raw content"
-                    )
-                    content = (
-                        transcription_note + raw_content
-                    )  # Add transcription note to the raw content
-                    for i in range(0, len(content), max_message_length):
-                        await bot.send_message(
-                            chat_id=update.effective_chat.id,
-                            text=content[i : i + max_message_length],
-                            parse_mode="HTML",
-                        )
-                        logger.info(
-                            f"Sent message chunk: {i // max_message_length + 1}"
-                        )
-                except Exception as e:
-                    logger.error(f"Error in sending plain text message: {e}")
-            else:
-                logger.info("Condition for sending plain text message not met.")
-
-            # Sending files if configured
-            if transcription_settings["send_as_files"]:
-                for fmt, path in transcription_paths.items():
+                # Here is where we add the transcription_note
+                transcription_note = "📝🔊 <i>(transcribed audio)</i>\n\n"
+                note_length = len(transcription_note)
+                max_message_length = (
+                    4096 - note_length
+                )  # Adjust max length to account for transcription note
+
+                if (
+                    transcription_settings["send_as_messages"]
+                    and "txt" in transcription_paths
+                ):
                     try:
-                        with open(path, "rb") as file:
-                            await bot.send_document(
-                                chat_id=update.effective_chat.id, document=file
-                            )
                         logger.info(
-                            f"Sent {fmt} file to user {update.effective_chat.id}: {path}"
+                            f"Preparing to send plain text message from raw content"
                         )
+                        content = (
+                            transcription_note + raw_content
+                        )  # Add transcription note to the raw content
+                        for i in range(0, len(content), max_message_length):
+                            await bot.send_message(
+                                chat_id=update.effective_chat.id,
+                                text=content[i : i + max_message_length],
+                                parse_mode="HTML",
+                            )
+                            logger.info(
+                                f"Sent message chunk: {i // max_message_length + 1}"
+                            )
                     except Exception as e:
-                        logger.error(
-                            f"Failed to send {fmt} file to user {update.effective_chat.id}: {path}, error: {e}"
+                        logger.error(f"Error in sending plain text message: {e}")
+                else:
+                    logger.info("Condition for sending plain text message not met.")
+
+                # Sending files if configured
+                if transcription_settings["send_as_files"]:
+                    await asyncio.gather(
+                        *(
+                            send_transcription_file(
+                                bot, update.effective_chat.id, fmt, path
+                            )
+                            for fmt, path in transcription_paths.items()
                         )
+                    )
 
-            # Check if we're keeping files or not
-            if not transcription_settings["keep_audio_files"] and os.path.exists(
-                audio_path
-            ):
-                os.remove(audio_path)
+                # Check if we're keeping files or not
+                keep_audio_files = transcription_settings["keep_audio_files"]
+                if not keep_audio_files and await aos.path.exists(audio_path):
+                    await aos.remove(audio_path)
 
-            completion_log_message = f"Translation complete for user {user_id}, video: {normalized_url}, model: {model}"
-            logging.info(completion_log_message)
+                await status.update("✅ Transcription complete.")
+
+                completion_log_message = f"Translation complete for user {user_id}, video: {normalized_url}, model: {model}"
+                logging.info(completion_log_message)
+            except Exception as e:
+                logger.error(f"An error occurred while processing {url}: {e}")
+                await status.update("An error occurred during processing.")
+
+        if sys.version_info >= (3, 11):
+            async with asyncio.TaskGroup() as tg:
+                for index, url in enumerate(urls):
+                    tg.create_task(_handle_one(url, index))
+        else:
+            await asyncio.gather(
+                *(_handle_one(url, index) for index, url in enumerate(urls)),
+                return_exceptions=True,
+            )
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
@@ -856,87 +1163,94 @@ def format_duration(duration):
         return f"{int(seconds)}s"
 
 
-# Fetch details for videos
-async def fetch_video_details(url, max_retries=3, base_delay=5, command_timeout=30):
-    command = [
-        "yt-dlp",
-        "--user-agent",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
-        "--dump-json",
-        url,
-    ]
+# cache key for video details; the video ID for YouTube URLs, otherwise the URL itself
+def get_video_details_cache_key(url):
+    try:
+        return extract_youtube_video_id(url)
+    except ValueError:
+        return url
 
-    last_stderr_output = ""
 
-    for attempt in range(max_retries):
-        try:
-            process = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+# return cached video details if they haven't expired yet
+def get_cached_video_details(url):
+    if VIDEO_DETAILS_CACHE_TTL <= 0:
+        return None
+    cached = video_details_cache.get(get_video_details_cache_key(url))
+    if cached is None:
+        return None
+    fetch_time, details = cached
+    if time.monotonic() - fetch_time > VIDEO_DETAILS_CACHE_TTL:
+        return None
+    # hand out a copy; callers add their own keys to the details
+    return dict(details)
+
+
+# store video details in the cache and drop any expired entries
+def cache_video_details(url, details):
+    if VIDEO_DETAILS_CACHE_TTL <= 0:
+        return
+    now = time.monotonic()
+    for key, (fetch_time, _) in list(video_details_cache.items()):
+        if now - fetch_time > VIDEO_DETAILS_CACHE_TTL:
+            del video_details_cache[key]
+    video_details_cache[get_video_details_cache_key(url)] = (now, dict(details))
+
+
+# Fetch details for videos
+# (if `audio_path` is given, the same yt-dlp run also downloads the audio as mp3)
+async def fetch_video_details(url, max_retries=3, base_delay=5, audio_path=None):
+    if audio_path is None:
+        cached_details = get_cached_video_details(url)
+        if cached_details is not None:
+            logger.info(f"Using cached video details for: {url}")
+            return cached_details
+    else:
+        download_options = get_audio_download_options(audio_path)
+        download_options["http_headers"] = {"User-Agent": YTDLP_USER_AGENT}
+        logger.info("Fetching video details and downloading audio-only...")
+
+    try:
+        if audio_path is None:
+            video_details = await run_ytdlp_with_retry(
+                extract_video_info, url, max_retries=max_retries, base_delay=base_delay
+            )
+        else:
+            video_details = await run_ytdlp_with_retry(
+                download_with_ytdlp,
+                url,
+                max_retries=max_retries,
+                base_delay=base_delay,
+                **download_options,
             )
+    except DownloadError as e:
+        stderr_output = str(e)
+        # Check for specific error messages; every yt-dlp error starts with
+        # "ERROR:", so that catch-all only applies to metadata lookups; a failed
+        # download can just as well be a network error or a missing ffmpeg
+        anti_bot_keywords = [
+            "Sign in to confirm you're not a bot",
+            "unable to extract initial player response",
+            "This video is unavailable",
+        ]
+        if audio_path is None:
+            anti_bot_keywords.append("ERROR:")
+        if any(keyword in stderr_output for keyword in anti_bot_keywords):
+            custom_error_message = (
+                "❌ Failed to fetch video details due to YouTube's anti-bot measures or video restrictions. "
+                "Possible reasons include age restrictions, region locks, or the video requiring sign-in. "
+                "Please try a different video URL, or see type /help for supported file formats for delivery. "
+                "If you are the administrator of this service, consider using cookies with `yt-dlp`."
+            )
+            raise Exception(custom_error_message)
+        elif audio_path is not None:
+            logger.error(f"yt-dlp failed with error:\n{stderr_output}")
+            raise Exception(f"Failed to download media: {stderr_output}")
+        else:
+            raise Exception(f"Failed to fetch video details: {stderr_output}")
 
-            try:
-                # Set a timeout for the command execution
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(), timeout=command_timeout
-                )
-            except asyncio.TimeoutError:
-                logger.error(
-                    f"yt-dlp command timed out after {command_timeout} seconds"
-                )
-                process.kill()
-                await process.wait()
-                stdout, stderr = None, b"Command timed out"
-
-            if stderr and process.returncode != 0:
-                stderr_output = stderr.decode()
-                last_stderr_output = stderr_output  # Save the last stderr output
-                logger.warning(f"Attempt {attempt + 1} failed: {stderr_output}")
-                if attempt < max_retries - 1:
-                    wait_time = base_delay * (2**attempt)
-                    logger.info(f"Retrying after {wait_time} seconds...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error("All retry attempts failed.")
-                    # Check for specific error messages
-                    if any(
-                        keyword in last_stderr_output
-                        for keyword in [
-                            "Sign in to confirm you're not a bot",
-                            "unable to extract initial player response",
-                            "This video is unavailable",
-                            "ERROR:",
-                        ]
-                    ):
-                        custom_error_message = (
-                            "❌ Failed to fetch video details due to YouTube's anti-bot measures or video restrictions. "
-                            "Possible reasons include age restrictions, region locks, or the video requiring sign-in. "
-                            "Please try a different video URL, or see type /help for supported file formats for delivery. "
-                            "If you are the administrator of this service, consider using cookies with `yt-dlp`."
-                        )
-                        raise Exception(custom_error_message)
-                    else:
-                        raise Exception(
-                            f"Failed to fetch video details: {last_stderr_output}"
-                        )
-            else:
-                try:
-                    video_details = json.loads(stdout.decode()) if stdout else {}
-                    return process_video_details(video_details, url)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error decoding JSON from yt-dlp output: {e}")
-                    raise Exception(f"❌ Error decoding JSON from yt-dlp output: {e}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            # If this was the last attempt, re-raise the exception
-            if attempt >= max_retries - 1:
-                raise
-            else:
-                # Otherwise, log and retry
-                wait_time = base_delay * (2**attempt)
-                logger.info(f"Retrying after {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
+    details = process_video_details(video_details or {}, url)
+    cache_video_details(url, details)
+    return details
 
 
 # process the video details for included information
@@ -986,11 +1300,16 @@ def get_description_snippet(description, max_lines=DESCRIPTION_MAX_LINES):
 
 
 # Regular expression for extracting the YouTube video ID
-YOUTUBE_REGEX = r"(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})"
+YOUTUBE_REGEX = r"(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|shorts/|v/|.+\?v=)?([^&=%\?]{11})"
+YOUTUBE_RE = re.compile(YOUTUBE_REGEX)
+
+# Regular expression for finding URLs in a message
+URL_RE = re.compile(r"(https?://\S+)")
 
 
+@functools.lru_cache(maxsize=4096)
 def extract_youtube_video_id(url):
-    match = re.match(YOUTUBE_REGEX, url)
+    match = YOUTUBE_RE.match(url)
     if not match:
         raise ValueError("Invalid YouTube URL")
     return match.group(6)
@@ -1035,6 +1354,19 @@ def normalize_youtube_url(url):
         return None
 
 
+# key for spotting repeated videos among a message's URLs: the video ID for
+# YouTube URLs (whatever form they come in), the URL itself otherwise
+def get_video_key(url):
+    if "youtube" in url or "youtu.be" in url:
+        normalized_url = normalize_youtube_url(url)
+        if normalized_url:
+            try:
+                return extract_youtube_video_id(normalized_url)
+            except ValueError:
+                pass
+    return url
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # estimate transcription times
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,185 @@
+# test_transcription_handler.py
+# tests for the helpers in src/transcription_handler.py, run with:
+# $ python -m pytest -q tests
+
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from yt_dlp.utils import DownloadError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+import transcription_handler  # noqa: E402
+from transcription_handler import (  # noqa: E402
+    extract_youtube_video_id,
+    format_timestamp,
+    scan_transcription_files,
+)
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"https://youtu.be/{VIDEO_ID}",
+        f"https://youtu.be/{VIDEO_ID}?si=abc123",
+        f"https://www.youtube.com/watch?v={VIDEO_ID}",
+        f"https://www.youtube.com/watch?v={VIDEO_ID}&t=42s",
+        f"https://www.youtube.com/embed/{VIDEO_ID}",
+        f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}",
+        f"https://www.youtube.com/shorts/{VIDEO_ID}",
+        f"https://youtube.com/shorts/{VIDEO_ID}?feature=share",
+        f"https://www.youtube.com/v/{VIDEO_ID}",
+    ],
+)
+def test_extract_youtube_video_id(url):
+    assert extract_youtube_video_id(url) == VIDEO_ID
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"https://example.com/watch?v={VIDEO_ID}",
+        f"https://youtube.evil.example/watch?v={VIDEO_ID}",
+        f"https://fakeyoutu.be/{VIDEO_ID}",
+        "https://vimeo.com/123456789",
+        # only `?v=` right after the path is recognised; callers normalize first
+        f"https://www.youtube.com/watch?feature=share&v={VIDEO_ID}",
+    ],
+)
+def test_extract_youtube_video_id_rejects_other_urls(url):
+    with pytest.raises(ValueError):
+        extract_youtube_video_id(url)
+
+
+@pytest.mark.parametrize(
+    "seconds, decimal_marker, expected",
+    [
+        (0, ",", "00:00:00,000"),
+        (1.5, ",", "00:00:01,500"),
+        (3661.25, ",", "01:01:01,250"),
+        (59.9996, ",", "00:01:00,000"),  # rounds up into the next minute
+        (12.3454, ".", "00:00:12.345"),
+    ],
+)
+def test_format_timestamp(seconds, decimal_marker, expected):
+    assert format_timestamp(seconds, decimal_marker) == expected
+
+
+def test_scan_transcription_files(tmp_path):
+    (tmp_path / f"{VIDEO_ID}.vtt").write_text("WEBVTT\n\nhello\n")
+    (tmp_path / f"{VIDEO_ID}.txt").write_text("hello\n")
+    (tmp_path / f"{VIDEO_ID}.srt").write_text("")  # empty files don't count
+    (tmp_path / "otherVideoId.srt").write_text("hello\n")
+    (tmp_path / f"{VIDEO_ID}.txt.1-2.part").write_text("hel")
+
+    found = scan_transcription_files(str(tmp_path), VIDEO_ID)
+
+    assert found == {
+        "txt": f"{tmp_path}/{VIDEO_ID}.txt",
+        "vtt": f"{tmp_path}/{VIDEO_ID}.vtt",
+    }
+    assert list(found) == ["txt", "vtt"]
+
+
+def test_fetch_video_details_reports_download_failures(monkeypatch, tmp_path):
+    def fail_download(url, **options):
+        raise DownloadError("ERROR: Postprocessing: ffprobe and ffmpeg not found")
+
+    monkeypatch.setattr(transcription_handler, "download_with_ytdlp", fail_download)
+
+    with pytest.raises(Exception, match="^Failed to download media: "):
+        asyncio.run(
+            transcription_handler.fetch_video_details(
+                f"https://www.youtube.com/watch?v={VIDEO_ID}",
+                base_delay=0,
+                audio_path=str(tmp_path / "audio.mp3"),
+            )
+        )
+
+
+@pytest.mark.parametrize(
+    "message, expected_calls",
+    [
+        ("ERROR: [youtube] abc: Video unavailable", 1),
+        ("ERROR: unable to download webpage: HTTP Error 429: Too Many Requests", 3),
+    ],
+)
+def test_run_ytdlp_with_retry_only_retries_transient_errors(message, expected_calls):
+    calls = []
+
+    def fail(url):
+        calls.append(url)
+        raise DownloadError(message)
+
+    with pytest.raises(DownloadError):
+        asyncio.run(
+            transcription_handler.run_ytdlp_with_retry(fail, "url", base_delay=0)
+        )
+    assert len(calls) == expected_calls
+
+
+def test_extract_video_info_closes_instances_that_use_cookies(monkeypatch):
+    instances = []
+
+    class FakeYoutubeDL:
+        def __init__(self, options):
+            self.closed = False
+            instances.append(self)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.closed = True  # YoutubeDL saves the cookie jar on close
+
+        def extract_info(self, url, download):
+            return {"id": VIDEO_ID}
+
+    monkeypatch.setattr(transcription_handler, "YoutubeDL", FakeYoutubeDL)
+    monkeypatch.setattr(
+        transcription_handler,
+        "get_ytdlp_options",
+        lambda **options: {"cookiefile": "cookies.txt", **options},
+    )
+    monkeypatch.setattr(transcription_handler, "ytdlp_local", threading.local())
+
+    for _ in range(2):
+        transcription_handler.extract_video_info(f"https://youtu.be/{VIDEO_ID}")
+
+    assert len(instances) == 2
+    assert all(instance.closed for instance in instances)
+
+
+def test_transcribe_with_replicate_saves_reusable_files(monkeypatch, tmp_path):
+    async def fake_async_run(model, input):
+        return {
+            "segments": [
+                {"start": 0.0, "end": 1.5, "text": " Hola."},
+                {"start": 1.5, "end": 3.0, "text": " Adiós."},
+            ]
+        }
+
+    monkeypatch.setattr(transcription_handler.replicate, "async_run", fake_async_run)
+    audio_path = tmp_path / "audio.mp3"
+    audio_path.write_bytes(b"")
+
+    paths, raw_content = asyncio.run(
+        transcription_handler.transcribe_with_replicate(
+            str(audio_path), str(tmp_path), VIDEO_ID
+        )
+    )
+
+    assert raw_content == "Hola.\nAdiós.\n"
+    assert open(paths["txt"]).read() == raw_content
+    assert "00:00:01,500 --> 00:00:03,000\nAdiós." in open(paths["srt"]).read()
+    assert (
+        asyncio.run(
+            transcription_handler.get_existing_transcriptions(str(tmp_path), VIDEO_ID)
+        )
+        == paths
+    )